@@ -1,16 +1,44 @@
 #!/usr/bin/env python
+# checks raise exceptions instead of using assert, so the script is safe to run with python -O
 
 import argparse
-from os.path import expanduser, isfile, isdir, basename, getmtime
-from json import load, loads, dumps
-from requests import get, post, put
-from os import makedirs, listdir 
+from os.path import expanduser, isfile, isdir, basename, join
+from posixpath import join as join_url
+from json import dumps
+try: # faster listing parsing when available
+    from orjson import loads
+except ImportError:
+    from json import loads
+from requests import Session
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from os import makedirs, scandir, replace, remove
+try: # posix only; lets the kernel read ahead on whole-file transfers
+    from os import posix_fadvise, POSIX_FADV_SEQUENTIAL
+except ImportError:
+    posix_fadvise = None
+from shutil import copyfileobj
+from uuid import uuid4
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import deque
+from functools import lru_cache
+try: # streams multipart uploads; without it requests builds the whole body in memory
+    from requests_toolbelt.multipart.encoder import MultipartEncoder
+except ImportError:
+    MultipartEncoder = None
 
 # global variables
 cache = '~/.agave/current'
 agave_prefix='agave://'
 url_prefix='http'
+chunk_size = 1 << 20 # bytes per read when streaming transfers
+executor = None # transfer thread pool; built in __main__ from --concurrency
+large_executor = None # separate pool for large uploads so they do not hold up small ones
+large_file_size = 64 << 20 # uploads above this many bytes go to large_executor
+large_file_workers = 2
+list_executor = None # pool for prefetching directory listings ahead of the worklist
+list_workers = 4
 
 # file types; set here to avoid repeated string use
 agave = 'agave'
@@ -21,131 +49,200 @@ local = 'local'
 def get_path_type(path):
     '''Determines if path is of local, agave, or url types.'''
     path_type=''
-    if path[:len(agave_prefix)] == agave_prefix:
+    if path.startswith(agave_prefix):
         path_type = agave
-    elif path[:len(url_prefix)] == url_prefix:
+    elif path.startswith(url_prefix):
         path_type = url
     else:
-        assert isfile(path) or isdir(path), 'Invalid local path: {}'.format(path)
+        if not (isfile(path) or isdir(path)):
+            raise ValueError('Invalid local path: {}'.format(path))
         path_type = local
     return path_type
 
 def agave_path_builder(base, path, recursive=False):
     '''Generates a ready-to-use agave url with the cached base and user-provided path'''
-    assert get_path_type(path) == agave, 'Path is type {}, must be type agave'.format(get_path_type(path))
+    if not path.startswith(agave_prefix):
+        raise ValueError('Path is type {}, must be type agave'.format(get_path_type(path)))
     # strip agave prefix
     path = path[len(agave_prefix): ]
     # return full path
     path = '{}/files/v2/media/system/{}'.format(base, path)
     return path
 
+@lru_cache(maxsize=None)
+def agave_url_prefixes(base):
+    '''Returns the (media, listings) url prefixes for base; built once per base url.'''
+    return ('{}/files/v2/media'.format(base), '{}/files/v2/listings'.format(base))
+
 def agave_path_setlisting(path, base, listings=True):
     '''Sets path prefix to /files/v2/listings/ when listings=True (default) and /files/v2/media/ when listings=False'''
+    media_prefix, listings_prefix = agave_url_prefixes(base)
     if listings:
-        path = path.replace('{}/files/v2/media'.format(base), '{}/files/v2/listings'.format(base))
+        path = path.replace(media_prefix, listings_prefix)
     else:
-        path = path.replace('{}/files/v2/listings'.format(base), '{}/files/v2/media'.format(base))
+        path = path.replace(listings_prefix, media_prefix)
     return path
 
-def sametype(local_filepath, agave_description):
-    '''Checks if local and agave files are both directories or files. Returns boolean.'''
-    return (isfile(local_filepath) and agave_description['type'] == 'file') or (isdir(local_filepath) and agave_description['type'] == 'dir')
+def sametype(local_entry, agave_description):
+    '''Checks if local os.scandir entry and agave file are both directories or files. Returns boolean.'''
+    return (local_entry.is_file() and agave_description['type'] == 'file') or (local_entry.is_dir() and agave_description['type'] == 'dir')
+
+def scan_local_dir(path):
+    '''Returns dictionary of name to os.scandir entry for the files in local directory path.'''
+    with scandir(path) as entries:
+        return { e.name: e for e in entries }
 
-def update_import_destfiles_dict(new_dest, headers, url_base):
+def update_import_destfiles_dict(new_dest, session, url_base):
     '''Helper function to update dictionary of destination file information'''
     new_dest = agave_path_setlisting(new_dest, url_base) # get list url
-    fdict = { i['name']: {'lastModified':i['lastModified'], 'type':i['type'], 'path':i['path']}
-               for i in list_agave_dir_files(new_dest, headers) }
+    fdict = { i['name']: i for i in list_agave_dir_files(new_dest, session) }
     return fdict
+
+def advise_sequential(f):
+    '''Tells the kernel open file f will be read or written front to back. Does nothing where posix_fadvise is unavailable.'''
+    if posix_fadvise is not None:
+        posix_fadvise(f.fileno(), 0, 0, POSIX_FADV_SEQUENTIAL)
+    return
+
+def new_dir_listing():
+    '''Returns file dictionary for a directory that was just made; it only holds '.', so there is no need to list it.'''
+    return { '.': {'name': '.', 'type': 'dir'} }
+
+def wait_for_transfers(futures):
+    '''Blocks until all submitted transfers finish. On the first failure, cancels the transfers not yet started and re-raises.'''
+    try:
+        for f in as_completed(futures):
+            f.result()
+    except BaseException:
+        cancel_transfers(futures)
+        raise
+    return
+
+def check_finished_transfers(futures):
+    '''Re-raises the failure of any transfer that has already finished, cancelling the transfers not yet started.'''
+    try:
+        for f in futures:
+            if f.done():
+                f.result()
+    except BaseException:
+        cancel_transfers(futures)
+        raise
+    return
+
+def cancel_transfers(futures):
+    '''Cancels every submitted transfer that has not started running yet.'''
+    for f in futures:
+        f.cancel()
+    return
+
+def upload_pool(entry):
+    '''Picks the thread pool for uploading an os.scandir entry: large files get their own pool, everything else shares the main one.'''
+    return (large_executor if entry.stat().st_size > large_file_size else executor)
 # end basic helper functions
 
 # request wrappers
-def list_agave_dir_files(url, headers):
+def list_agave_dir_files(url, session):
     '''Performs files-list on remote agave directory and returns list of file JSON descriptions'''
-    r = get(url, headers=headers)
-    assert r.status_code == 200, 'Unable to list files at {}; status code {}'.format(url, r.status_code)
+    r = session.get(url)
+    if r.status_code != 200:
+        raise RuntimeError('Unable to list files at {}; status code {}'.format(url, r.status_code))
     l = loads(r.content)
-    assert l.get('result') is not None, 'Unable to read file info from key "result" in JSON \n{}'.format(dumps(l, indent=2))
+    if l.get('result') is None:
+        raise RuntimeError('Unable to read file info from key "result" in JSON \n{}'.format(dumps(l, indent=2)))
     return l['result']
 
-def files_download(url, headers, path='.', name=None):
+def files_download(url, session, path='.', name=None):
     '''Downloads and saves file at url. Defaults to saving in the current directory without changing name, but these options are available.'''
-    r = get(url, headers=headers)
-    assert r.status_code == 200, 'files-download failed with code {}'.format(r.status_code)
     # set up path
     if name is None:
         name = basename(url)
-    path += '/'+name
-    with open(expanduser(path), 'wb') as f:
-        f.write(r.content)
+    path = join(expanduser(path), name)
+    # stream response to a temporary file beside path rather than holding the whole file in memory;
+    # it only replaces path once complete, so a dropped connection leaves any existing copy intact
+    with session.get(url, stream=True) as r:
+        if r.status_code != 200:
+            raise RuntimeError('files-download failed with code {}'.format(r.status_code))
+        r.raw.decode_content = True
+        tmppath = '{}.{}.part'.format(path, uuid4().hex) # unique, so concurrent runs never share it
+        try:
+            with open(tmppath, 'xb', buffering=chunk_size) as f:
+                advise_sequential(f)
+                copyfileobj(r.raw, f, chunk_size)
+            replace(tmppath, path)
+        except BaseException:
+            if isfile(tmppath):
+                remove(tmppath)
+            raise
     return
 
-def files_upload(localfile, url, headers, new_name=None):
+def files_upload(localfile, url, session, new_name=None):
     '''Uploads file at localfile path to url. Name at location can be specified with new_name; defaults to current name.'''
-    assert isfile(localfile), 'Local file {} does not exists or is directory'.format(localfile)
     # set new_name to current name if not given
     if new_name is None:
         new_name = basename(localfile)
-    # format file data and run command
-    files = {'fileToUpload': (new_name, open(expanduser(localfile), 'rb'))}
-    r = post(url, headers=headers, files=files)
-    assert r.status_code == 202, 'Command status code is {}, not 202'.format(r.status_code)
+    # format file data and run command, streaming the file from disk when possible
+    with open(expanduser(localfile), 'rb') as fh:
+        advise_sequential(fh)
+        if MultipartEncoder is not None:
+            m = MultipartEncoder(fields={'fileToUpload': (new_name, fh, 'application/octet-stream')})
+            r = session.post(url, data=m, headers={'Content-Type': m.content_type})
+        else:
+            r = session.post(url, files={'fileToUpload': (new_name, fh)})
+    if r.status_code != 202:
+        raise RuntimeError('Command status code is {}, not 202'.format(r.status_code))
     return
 
-def files_mkdir(dirname, url, headers):
+def files_mkdir(dirname, url, session):
     '''Makes a directory at the agave url path.'''
     data = {'action': 'mkdir', 'path':dirname}
-    r = put(url+'/', data=data, headers=headers)
-    assert r.status_code == 201, 'Mkdir status_code was {}'.format(r.status_code)
+    r = session.put(url+'/', data=data)
+    if r.status_code != 201:
+        raise RuntimeError('Mkdir status_code was {}'.format(r.status_code))
     return
 
-def files_import(source, destination, headers, new_name=None):
+def files_import(source, destination, session, new_name=None):
     '''Import file from remote source to remote destination. New name defaults to current name.'''
     if new_name is None:
         new_name = basename(source)
     data = {'urlToIngest': source, 'fileName': new_name}
-    r = post(destination, headers=headers, data=data)
-    assert r.status_code == 202, 'Command status code is {}, not 202'.format(r.status_code)
+    r = session.post(destination, data=data)
+    if r.status_code != 202:
+        raise RuntimeError('Command status code is {}, not 202'.format(r.status_code))
     return
 # end request wrappers
 
 # modification time helper functions
-def get_localfile_modtime(localfile):
-    '''Given path to file, returns datetime of last modification on that file.'''
-    assert isfile(localfile) or isdir(localfile), 'Local file {} does not exist'.format(localfile)
-    return datetime.fromtimestamp(getmtime(localfile))
-
 def get_agavefile_modtime(agavedescription):
     '''Given Agave file JSON file description (only lastModified key required), returns datetime of last modification on that file.'''
-    assert 'lastModified' in agavedescription, 'lastModified key not in Agave description keys: {}'.format(agavedescription.keys())
-    # strip '.000-0X:00' off modtime (unknown meaning)
-    modstring = agavedescription['lastModified'][:-10] 
-    strptime_format = '%Y-%m-%dT%H:%M:%S'
-    return datetime.strptime(modstring, strptime_format)
-
-def newer_agavefile(localfile, agavedescription):
-    '''Given local filepath and Agave file JSON description (only lastModified key required), return TRUE if Agave file is more recently modified.'''
-    assert isfile(localfile) or isdir(localfile), 'Local file {} does not exist'.format(localfile)
-    assert 'lastModified' in agavedescription, 'lastModified key not in Agave description keys: {}'.format(agavedescription.keys())
-    local_modtime = get_localfile_modtime(localfile)
+    return parse_agave_timestamp(agavedescription['lastModified'])
+
+@lru_cache(maxsize=None)
+def parse_agave_timestamp(modstring):
+    '''Parses an Agave lastModified string; the same strings recur across listings, so results are cached.'''
+    # keep only 'YYYY-MM-DDTHH:MM:SS', stripping '.000-0X:00' off modtime (unknown meaning)
+    return datetime.fromisoformat(modstring[:19])
+
+def newer_agavefile(local_mtime, agavedescription):
+    '''Given local file st_mtime (e.g. from an os.scandir entry's stat) and Agave file JSON description (only lastModified key required), return TRUE if Agave file is more recently modified.'''
+    local_modtime = datetime.fromtimestamp(local_mtime)
     agave_modtime = get_agavefile_modtime(agavedescription)
     return (agave_modtime > local_modtime)
 
 def newer_importfile(import_description, dest_description):
     '''Given import and destination Agave file JSON descriptions (only lastModified key required), return TRUE if import file is more recently modified.'''
-    assert 'lastModified' in import_description, 'lastModified key not in import description keys: {}'.format(import_description.keys())
-    assert 'lastModified' in dest_description, 'lastModified key not in destination description keys: {}'.format(dest_description.keys())
     import_modtime = get_agavefile_modtime(import_description)
     dest_modtime = get_agavefile_modtime(dest_description)
     return(import_modtime > dest_modtime)
 # end modification time helper functions
 
 # recursive files functions
-def recursive_get(url, headers, url_base, destination='.', skipdir=False, tab=''):
-    '''Performs recursive files-get from remote to local location (ONLY AGAVE CURRENTLY SUPPORTED)'''
-    # get listable url and file-list
+def get_dir(url, session, url_base, futures, destination='.', skipdir=False, tab='', listing=None):
+    '''Downloads one remote agave directory for recursive_get. Returns worklist items for its subdirectories.'''
+    # get listable url and file-list, using the prefetched listing if given
     list_url = agave_path_setlisting(url, url_base)
-    list_json = list_agave_dir_files(list_url, headers)
+    list_json = (listing.result() if listing is not None else list_agave_dir_files(list_url, session))
+    existing = None # entries already in destination; read once per directory
+    subdirs = []
 
     for i in list_json:
         filename = i['name']
@@ -156,91 +253,134 @@ def recursive_get(url, headers, url_base, destination='.', skipdir=False, tab=''
             if skipdir: # if skip is set, pass without change
                 print(tab+'skipping', directoryname, '(matching with {})'.format(destination))
             else: # set new destination; make dir if necessary
-                destination += '/{}'.format(directoryname) # add dirname to local path
+                destination = join(destination, directoryname) # add dirname to local path
                 if isdir(destination):
                     print(tab+'skipping', directoryname, '(exists)')
                 else:
                     print(tab+'mkdir', destination)
                     makedirs(destination)
+            existing = scan_local_dir(destination)
             tab += '  '
 
-        # elif is not '.' but still directory, recurse
+        # elif is not '.' but still directory, queue it and start listing it so it arrives while files download
         elif i['type'] == 'dir':
-            recursion_url = '{}/{}'.format(url,filename)
-            recursive_get(recursion_url, headers, url_base, destination=destination, tab=tab)
+            subdir_listing = list_executor.submit(list_agave_dir_files, join_url(list_url, filename), session)
+            subdirs.append((join_url(url, filename), destination, tab, subdir_listing))
 
         # must be file; download if not in local dir (new) or agave timestamp is newer (modified), otherwise skip
         else:
             # build file url by adding filename
-            file_url = '{}/{}'.format(url, filename)
-            filename_fullpath = '{}/{}'.format(destination, filename)
-            if filename not in listdir(destination):
+            file_url = join_url(url, filename)
+            if existing is None:
+                existing = scan_local_dir(destination)
+            if filename not in existing:
                 print(tab+'downloading', filename, '(new)')
-                files_download(file_url, headers, path=destination)
-            elif newer_agavefile(filename_fullpath, i):
+                futures.append(executor.submit(files_download, file_url, session, path=destination))
+            elif newer_agavefile(existing[filename].stat().st_mtime, i):
                 print(tab+'downloading', filename, '(modified)')
-                files_download(file_url, headers, path=destination)
+                futures.append(executor.submit(files_download, file_url, session, path=destination))
             else:
                 print(tab+'skipping', filename, '(exists)')
+    return subdirs
+
+def recursive_get(url, session, url_base, destination='.', skipdir=False):
+    '''Performs recursive files-get from remote to local location (ONLY AGAVE CURRENTLY SUPPORTED)'''
+    # walk breadth-first from a worklist of (url, destination, tab, listing) directories;
+    # downloads from every directory share one list, checked after each directory and waited on at the end
+    futures = []
+    work = deque(get_dir(url, session, url_base, futures, destination=destination, skipdir=skipdir))
+    while work:
+        check_finished_transfers(futures) # stop the walk early if a transfer already failed
+        dir_url, dir_destination, tab, listing = work.popleft()
+        work.extend(get_dir(dir_url, session, url_base, futures, destination=dir_destination, tab=tab, listing=listing))
+    wait_for_transfers(futures)
     return
 
-def recursive_upload(url, headers, url_base, source='.', skipdir=False, urlinfo={}, tab=''):
-    '''Recursively upload files from a local directory to an agave directory'''
-    assert url[-1] != '/', 'Provided url cannot have trailing slashe: {}'.format(url)
-    assert source[-1] != '/', 'Provided source cannot have trailing slash: {}'.format(source)
+def upload_dir(url, session, url_base, futures, source='.', skipdir=False, urlinfo={}, tab='', listing=None):
+    '''Uploads one local directory into the agave directory at url for recursive_upload. Returns worklist items for its subdirectories.'''
+    if url[-1] == '/':
+        raise ValueError('Provided url cannot have trailing slash: {}'.format(url))
+    if source[-1] == '/':
+        raise ValueError('Provided source cannot have trailing slash: {}'.format(source))
 
     # make agave url listable
     list_url = agave_path_setlisting(url, url_base, listings=True)
 
     # if no previous agave files provided, list
     if len(urlinfo) == 0:
-        urlfiles = list_agave_dir_files(list_url, headers)
-        urlinfo = {i['name']:{'lastModified':i['lastModified'],'type':i['type']} for i in urlfiles}
-        assert '.' in urlinfo, 'Url {} is not valid directory: {}'.format(url)
+        urlfiles = list_agave_dir_files(list_url, session)
+        urlinfo = {i['name']: i for i in urlfiles}
+        if '.' not in urlinfo:
+            raise RuntimeError('Url {} is not valid directory'.format(url))
 
     # check base dir: skip if matching, make if missing, ignore if already exists
     dirname = basename(source)
     if skipdir:
         print(tab+'skipping', dirname, '(matching with {})'.format(basename(url)))
     else: # mkdir if needed, then update urls and current files
-        if dirname not in urlinfo:
+        made = dirname not in urlinfo
+        if made:
             print(tab+'mkdir', dirname, '(new)')
-            files_mkdir(dirname, url, headers)
-        url += '/{}'.format(dirname)
-        list_url += '/{}'.format(dirname)
-        urlfiles = list_agave_dir_files(list_url, headers)
-        urlinfo = {i['name']:{'lastModified':i['lastModified'],'type':i['type']} for i in urlfiles}
-        assert '.' in urlinfo, 'url {} is not valid directory'.format(url)
+            files_mkdir(dirname, url, session)
+        url = join_url(url, dirname)
+        list_url = join_url(list_url, dirname)
+        # a directory just made is empty, so only list one that already existed
+        if made:
+            urlinfo = new_dir_listing()
+        else:
+            urlfiles = (listing.result() if listing is not None else list_agave_dir_files(list_url, session))
+            urlinfo = {i['name']: i for i in urlfiles}
+            if '.' not in urlinfo:
+                raise RuntimeError('Url {} is not valid directory'.format(url))
 
     # process files between remote and agave directories
-    for filename in listdir(expanduser(source)):
-        fullpath = (expanduser(source) if filename == '.' else '{}/{}'.format(expanduser(source), filename))
-        # if local file present at dest: skip if is dir or if agavefile is newer, else upload file
-        if filename in urlinfo and sametype(fullpath, urlinfo[filename]):
-            if isdir(fullpath) or newer_agavefile(fullpath, urlinfo[filename]):
-                print(tab+'  skipping', filename, '(exists)')
-            else:
-                print(tab+'  uploading', filename, '(modified)')
-                files_upload(fullpath, url, headers)
-        # if local file is new, upload file
-        elif isfile(fullpath):
-            print(tab+'  uploading', filename, '(new)')
-            files_upload(fullpath, url, headers)
-
-        # if is directory (newly made or old), recurse
-        if isdir(fullpath):
-            recursive_upload(url, headers, url_base, source=fullpath, urlinfo=urlinfo, tab=tab+'  ')
+    subdirs = []
+    with scandir(expanduser(source)) as entries:
+        for entry in entries:
+            filename = entry.name
+            fullpath = entry.path
+            # if local file present at dest: skip if is dir or if agavefile is newer, else upload file
+            if filename in urlinfo and sametype(entry, urlinfo[filename]):
+                if entry.is_dir() or newer_agavefile(entry.stat().st_mtime, urlinfo[filename]):
+                    print(tab+'  skipping', filename, '(exists)')
+                else:
+                    print(tab+'  uploading', filename, '(modified)')
+                    futures.append(upload_pool(entry).submit(files_upload, fullpath, url, session))
+            # if local file is new, upload file
+            elif entry.is_file():
+                print(tab+'  uploading', filename, '(new)')
+                futures.append(upload_pool(entry).submit(files_upload, fullpath, url, session))
+
+            # if is directory (newly made or old), queue it; start listing it now if it already exists remotely
+            if entry.is_dir():
+                subdir_listing = (list_executor.submit(list_agave_dir_files, join_url(list_url, filename), session) if filename in urlinfo else None)
+                subdirs.append((url, fullpath, urlinfo, tab+'  ', subdir_listing))
+    return subdirs
+
+def recursive_upload(url, session, url_base, source='.', skipdir=False):
+    '''Recursively upload files from a local directory to an agave directory'''
+    # walk breadth-first from a worklist of (url, source, urlinfo, tab, listing) directories;
+    # uploads from every directory share one list, checked after each directory and waited on at the end
+    futures = []
+    work = deque(upload_dir(url, session, url_base, futures, source=source, skipdir=skipdir))
+    while work:
+        check_finished_transfers(futures) # stop the walk early if a transfer already failed
+        dir_url, dir_source, urlinfo, tab, listing = work.popleft()
+        work.extend(upload_dir(dir_url, session, url_base, futures, source=dir_source, urlinfo=urlinfo, tab=tab, listing=listing))
+    wait_for_transfers(futures)
     return
 
-def recursive_import(source, destination, headers, url_base, skipdir=False, dfiles={}, tab=''):
-    '''Performs recursive files-import between remote agave locations.'''
+def import_dir(source, destination, session, url_base, futures, skipdir=False, dfiles={}, tab='', listing=None):
+    '''Imports one remote agave directory for recursive_import. Returns worklist items for its subdirectories.'''
     # get source list url
     slisturl = agave_path_setlisting(source, url_base)
 
-    # get dict of destination files -- WHY DO WE NEED THIS? implement dfiles param
-    dfiles = update_import_destfiles_dict(destination, headers, url_base)
+    # get dict of destination files unless the caller already listed destination
+    if len(dfiles) == 0:
+        dfiles = update_import_destfiles_dict(destination, session, url_base)
 
-    for finfo in list_agave_dir_files(slisturl, headers):
+    subdirs = []
+    for finfo in (listing.result() if listing is not None else list_agave_dir_files(slisturl, session)):
         fname = finfo['name']
 
         # if dir and '.': skip if matching, make if missing, ignore if already exists
@@ -253,27 +393,41 @@ def recursive_import(source, destination, headers, url_base, skipdir=False, dfil
                     print(tab+'skipping', dirname, '(exists)')
                 else:
                     print(tab+'mkdir', dirname, '(new)')
-                    files_mkdir(dirname, destination, headers)
-                destination += '/{}'.format(dirname)
-                dfiles = update_import_destfiles_dict(destination, headers, url_base)
+                    files_mkdir(dirname, destination, session)
+                destination = join_url(destination, dirname)
+                # a directory just made is empty, so only list one that already existed
+                dfiles = (update_import_destfiles_dict(destination, session, url_base) if dirname in dfiles else new_dir_listing())
             tab += '  '
 
-        # elif is not '.' but still directory, recurse
+        # elif is not '.' but still directory, queue it and start listing it now
         elif finfo['type'] == 'dir':
-            recursion_source = '{}/{}'.format(source,fname)
-            recursive_import(recursion_source, destination, headers, url_base, dfiles=dfiles, tab=tab)
+            subdir_listing = list_executor.submit(list_agave_dir_files, join_url(slisturl, fname), session)
+            subdirs.append((join_url(source, fname), destination, dfiles, tab, subdir_listing))
 
         # must be file; import if not in dest dir (new) or source timestamp is newer (modified), otherwise skip
         else:
-            fpath = '{}/{}'.format(source, fname)
+            fpath = join_url(source, fname)
             if fname not in dfiles:
                 print(tab+'importing', fname, '(new)')
-                files_import(fpath, destination, headers)
+                futures.append(executor.submit(files_import, fpath, destination, session))
             elif newer_importfile(finfo, dfiles[fname]):
                 print(tab+'importing', fname, '(modified)')
-                files_import(fpath, destination, headers)
+                futures.append(executor.submit(files_import, fpath, destination, session))
             else:
                 print(tab+'skipping', fname, '(exists)')
+    return subdirs
+
+def recursive_import(source, destination, session, url_base, skipdir=False):
+    '''Performs recursive files-import between remote agave locations.'''
+    # walk breadth-first from a worklist of (source, destination, dfiles, tab, listing) directories;
+    # imports from every directory share one list, checked after each directory and waited on at the end
+    futures = []
+    work = deque(import_dir(source, destination, session, url_base, futures, skipdir=skipdir))
+    while work:
+        check_finished_transfers(futures) # stop the walk early if a transfer already failed
+        dir_source, dir_destination, dfiles, tab, listing = work.popleft()
+        work.extend(import_dir(dir_source, dir_destination, session, url_base, futures, dfiles=dfiles, tab=tab, listing=listing))
+    wait_for_transfers(futures)
     return
 # end recursive files functions
 
@@ -283,6 +437,7 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Script to combine files-upload, files-get, and files-import. When recursion (-r) specified, a trailing slash on source path syncs contents of source and destination; no trailing slash nests source under destination.')
     parser.add_argument('-n', '--name', dest='name', help='new file name')
     parser.add_argument('-r', '--recursive', dest='recursive', default=False, action='store_true', help='sync recursively')
+    parser.add_argument('-j', '--concurrency', dest='concurrency', type=int, default=8, help='number of simultaneous transfers when recursing (default 8)')
     parser.add_argument('source', help='source path (local, agave, or url)')
     parser.add_argument('destination', default='.', nargs='?', help='destination path (local or agave; default $PWD)')
     args = parser.parse_args()
@@ -290,16 +445,31 @@ if __name__ == '__main__':
     # if recursive run, ignore name flag
     if args.recursive and args.name is not None:
         print('Ignoring name flag due to recursion.')
+    if args.concurrency < 1:
+        exit('Concurrency must be at least 1.')
+    executor = ThreadPoolExecutor(max_workers=args.concurrency)
+    large_executor = ThreadPoolExecutor(max_workers=large_file_workers)
+    list_executor = ThreadPoolExecutor(max_workers=list_workers)
 
-    # read cache to get baseurl & token, then build header
+    # read cache to get baseurl & token
     try:
-        cache_json = load(open(expanduser(cache)))
+        with open(expanduser(cache), 'rb') as f:
+            cache_json = loads(f.read())
         access_token = cache_json['access_token']
         baseurl = cache_json['baseurl']
         expire = datetime.fromtimestamp(int(cache_json['created_at'])+int(cache_json['expires_in']))
     except:
         exit('Error reading from cache {}'.format(cache))
-    h = { 'Authorization': 'Bearer {}'.format(access_token) }
+
+    # build one session for the whole run so connections are kept alive between requests;
+    # pool is sized to the transfer thread pools, idempotent requests retry on gateway errors
+    session = Session()
+    session.headers.update({ 'Authorization': 'Bearer {}'.format(access_token) })
+    retries = Retry(total=3, backoff_factor=0.2, status_forcelist=[502, 503, 504], raise_on_status=False)
+    pool_size = args.concurrency + large_file_workers + list_workers
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
 
     # if access token is expired, quit
     if expire < datetime.now():
@@ -324,37 +494,49 @@ if __name__ == '__main__':
     if dest_type == agave:
         args.destination = agave_path_builder(baseurl, args.destination)
 
-    # source=agave/url and dest=local --> get
-    if source_type != local and dest_type == local:
-        if not args.recursive: # if no recursion, do simple import
-            print('Downloading', basename(args.source), 'to', args.destination, ('as {}'.format(args.name) if args.name is not None else ''))
-            files_download(args.source, h, path=args.destination, name=args.name)
-        elif source_type == url: # ERROR if recursive and url source
-            exit('Cannot recursively download from a generic url. Can only recursively download from an agave system.')
-        else: # download recursively from agave source
-            print('Beginnning recursive download...')
-            recursive_get(args.source, h, baseurl, destination=args.destination, skipdir=source_slash)
+    try:
+        # source=agave/url and dest=local --> get
+        if source_type != local and dest_type == local:
+            if not args.recursive: # if no recursion, do simple import
+                print('Downloading', basename(args.source), 'to', args.destination, ('as {}'.format(args.name) if args.name is not None else ''))
+                files_download(args.source, session, path=args.destination, name=args.name)
+            elif source_type == url: # ERROR if recursive and url source
+                exit('Cannot recursively download from a generic url. Can only recursively download from an agave system.')
+            else: # download recursively from agave source
+                print('Beginnning recursive download...')
+                recursive_get(args.source, session, baseurl, destination=args.destination, skipdir=source_slash)
     
-    # source=local and dest=agave --> upload
-    elif source_type == local and dest_type == agave:
-        if args.recursive:
-            print('Beginning recursive upload...')
-            recursive_upload(args.destination, h, baseurl, source=args.source, skipdir=source_slash)
+        # source=local and dest=agave --> upload
+        elif source_type == local and dest_type == agave:
+            if args.recursive:
+                print('Beginning recursive upload...')
+                recursive_upload(args.destination, session, baseurl, source=args.source, skipdir=source_slash)
+            elif not isfile(expanduser(args.source)):
+                exit('Local file {} is a directory; specify a recursive upload.'.format(args.source))
+            else:
+                print('Uploading', basename(args.source), 'to', args.destination, ('as {}'.format(args.name) if args.name is not None else ''))
+                files_upload(expanduser(args.source), args.destination, session, new_name=args.name)
+
+        # source=agave/url and dest=agave --> import
+        elif source_type != local and dest_type == agave:
+            if not args.recursive: # if no recursion, do simple import
+                print('Importing', basename(args.source), 'to', args.destination, ('as {}'.format(args.name) if args.name is not None else ''))
+                files_import(args.source, args.destination, session, new_name=args.name)
+            elif source_type == url: # ERROR if recursive and url source
+                exit('Cannot recursively import from a generic url. Can only recursively import from another agave system.')
+            else: # import recursively from agave source
+                print('Beginning recursive import...')
+                recursive_import(args.source, args.destination, session, baseurl, skipdir=source_slash)
+
+        # other combos --> error 
         else:
-            print('Uploading', basename(args.source), 'to', args.destination, ('as {}'.format(args.name) if args.name is not None else ''))
-            files_upload(expanduser(args.source), args.destination, h, new_name=args.name)
-
-    # source=agave/url and dest=agave --> import
-    elif source_type != local and dest_type == agave:
-        if not args.recursive: # if no recursion, do simple import
-            print('Importing', basename(args.source), 'to', args.destination, ('as {}'.format(args.name) if args.name is not None else ''))
-            files_import(args.source, args.destination, h, new_name=args.name)
-        elif source_type == url: # ERROR if recursive and url source
-            exit('Cannot recursively import from a generic url. Can only recursively import from another agave system.')
-        else: # import recursively from agave source
-            print('Beginning recursive import...')
-            recursive_import(args.source, args.destination, h, baseurl, skipdir=source_slash)
-
-    # other combos --> error 
-    else:
-        exit('Cannot have source type {} and destination type {}'.format(source_type, dest_type))
\ No newline at end of file
+            exit('Cannot have source type {} and destination type {}'.format(source_type, dest_type))
+    except BaseException:
+        # stop queued transfers and listings so the first failure ends the run instead of waiting on the rest
+        for pool in (executor, large_executor, list_executor):
+            pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    executor.shutdown()
+    large_executor.shutdown()
+    list_executor.shutdown()
+    session.close()
\ No newline at end of file